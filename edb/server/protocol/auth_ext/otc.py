@@ -31,6 +31,9 @@ from . import errors, util
 logger = logging.getLogger(__name__)
 
 MAX_ATTEMPTS = 5
+# Upper bound on expired codes deleted by the GC run of a single
+# verification; any backlog is drained by subsequent verifications.
+GC_BATCH_SIZE = 4096
 
 
 def generate_code() -> str:
@@ -126,7 +129,8 @@ with
     now := datetime_current(),
     window_start := now - <duration>'10 minutes',
 
-    # Check rate limits
+    # Check rate limits. Only whether MAX_ATTEMPTS is reached matters,
+    # so stop counting there instead of scanning the whole window.
     failed_attempts := (
         select count(
             select ext::auth::AuthenticationAttempt
@@ -135,6 +139,7 @@ with
                    ext::auth::AuthenticationAttemptType.OneTimeCode
                and .successful = false
                and .created_at > window_start
+            limit MAX_ATTEMPTS
         )
     ),
 
@@ -201,9 +206,12 @@ with
 
 # Cleanup expired codes
 select count(
-    delete ext::auth::OneTimeCode filter .expires_at < now
+    delete ext::auth::OneTimeCode
+    filter .expires_at < now
+    limit <int64>$batch_size
 )
             """,
+            variables={"batch_size": GC_BATCH_SIZE},
             tx_isolation=defines.TxIsolationLevel.RepeatableRead,
         )
     except Exception:
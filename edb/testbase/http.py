@@ -25,6 +25,8 @@ from typing import (
 )
 
 import asyncio
+import contextlib
+import http.client
 import http.server
 import json
 import threading
@@ -59,22 +61,36 @@ class BaseHttpTest(server.QueryTestCase):
     ):
         dbname = cls.get_database_name()
         # Wait for the database config changes to propagate to the
-        # server by watching a debug endpoint
-        async for tr in cls.try_until_succeeds(
-            ignore=AssertionError,
-            timeout=120,
-        ):
-            async with tr:
-                with cls.http_con(server) as http_con:
-                    (
-                        rdata,
-                        _headers,
-                        _status,
-                    ) = cls.http_con_request(
-                        http_con,
-                        prefix="",
-                        path="server-info",
-                    )
+        # server by watching a debug endpoint.  There is no notification
+        # for config changes, so poll, reusing one keep-alive connection
+        # across attempts.  If the server drops it between polls, open a
+        # new one on the next attempt.
+        with contextlib.ExitStack() as cons:
+            http_con = None
+            async for tr in cls.try_until_succeeds(
+                ignore=(
+                    AssertionError,
+                    OSError,
+                    http.client.HTTPException,
+                ),
+                timeout=120,
+            ):
+                async with tr:
+                    if http_con is None:
+                        http_con = cons.enter_context(cls.http_con(server))
+                    try:
+                        (
+                            rdata,
+                            _headers,
+                            _status,
+                        ) = cls.http_con_request(
+                            http_con,
+                            prefix="",
+                            path="server-info",
+                        )
+                    except (OSError, http.client.HTTPException):
+                        http_con = None
+                        raise
                     data = json.loads(rdata)
                     if "databases" not in data:
                         # multi-tenant instance - use the first tenant
@@ -541,6 +557,11 @@ class MockHttpServer:
             ),
         ] = {}
         self.requests: dict[tuple[str, str, str], list[RequestDetails]] = {}
+        self._requests_lock = threading.Lock()
+        self._request_waiters: dict[
+            tuple[str, str, str],
+            list[tuple[int, asyncio.AbstractEventLoop, asyncio.Event]],
+        ] = {}
         self.url: Optional[str] = None
         self.handler_type = handler_type
 
@@ -568,6 +589,32 @@ class MockHttpServer:
 
         return wrapper
 
+    async def wait_for_requests(
+        self,
+        method: str,
+        server: str,
+        path: str,
+        count: int,
+    ) -> list[RequestDetails]:
+        """Wait until at least *count* requests were made to the route.
+
+        Requests are handled on the server thread, which wakes the waiting
+        event loop up as soon as the count is reached.
+        """
+        key = (method, server, path)
+        event = asyncio.Event()
+        waiter = (count, asyncio.get_running_loop(), event)
+        with self._requests_lock:
+            if len(self.requests.get(key, ())) >= count:
+                return self.requests[key]
+            self._request_waiters.setdefault(key, []).append(waiter)
+        try:
+            await event.wait()
+        finally:
+            with self._requests_lock:
+                self._request_waiters[key].remove(waiter)
+        return self.requests[key]
+
     def handle_request(
         self,
         method: str,
@@ -578,8 +625,6 @@ class MockHttpServer:
         # `handler` is documented here:
         # https://docs.python.org/3/library/http.server.html#http.server.BaseHTTPRequestHandler
         key = (method, server, path)
-        if key not in self.requests:
-            self.requests[key] = []
 
         # Parse and save the request details
         parsed_path = urllib.parse.urlparse(path)
@@ -595,7 +640,12 @@ class MockHttpServer:
             query_params=query_params,
             body=body,
         )
-        self.requests[key].append(request_details)
+        with self._requests_lock:
+            requests = self.requests.setdefault(key, [])
+            requests.append(request_details)
+            for count, loop, event in self._request_waiters.get(key, ()):
+                if len(requests) >= count:
+                    loop.call_soon_threadsafe(event.set)
         if key not in self.routes:
             error_message = (
                 f"No route handler for {key}\n\n"
@@ -429,6 +429,16 @@ class RollbackChanges:
         await self._tx.rollback()
 
 
+class HttpResponse(NamedTuple):
+    body: bytes
+    headers: dict[str, str]
+    status: int
+
+    @property
+    def location(self) -> Optional[str]:
+        return self.headers.get("location")
+
+
 class TestCaseWithHttpClient(TestCase):
     @classmethod
     def get_api_prefix(cls):
@@ -498,11 +508,11 @@ class TestCaseWithHttpClient(TestCase):
     def http_con_read_response(
         cls,
         http_con: http.client.HTTPConnection,
-    ) -> tuple[bytes, dict[str, str], int]:
+    ) -> HttpResponse:
         resp = http_con.getresponse()
         resp_body = resp.read()
         resp_headers = {k.lower(): v for k, v in resp.getheaders()}
-        return resp_body, resp_headers, resp.status
+        return HttpResponse(resp_body, resp_headers, resp.status)
 
     @classmethod
     def http_con_request(
@@ -515,7 +525,7 @@ class TestCaseWithHttpClient(TestCase):
         method: str = "GET",
         body: bytes = b"",
         path: str = "",
-    ) -> tuple[bytes, dict[str, str], int]:
+    ) -> HttpResponse:
         cls.http_con_send_request(
             http_con,
             params,
@@ -558,6 +568,28 @@ class TestCaseWithHttpClient(TestCase):
 
         return result, headers, status
 
+    @classmethod
+    def http_con_form_request(
+        cls,
+        http_con: http.client.HTTPConnection,
+        form: dict[str, str],
+        *,
+        prefix: Optional[str] = None,
+        headers: Optional[dict[str, str]] = None,
+        path: str = "",
+    ) -> HttpResponse:
+        return cls.http_con_request(
+            http_con,
+            method="POST",
+            body=urllib.parse.urlencode(form).encode(),
+            prefix=prefix,
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+                **(headers or {}),
+            },
+            path=path,
+        )
+
     @classmethod
     def http_con_binary_request(
         cls,